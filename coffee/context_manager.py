@@ -1,58 +1,133 @@
 # context_manager.py
 import os
 import json
-import re
 import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from types import MappingProxyType
 
-CONTEXT_FILE = os.path.expanduser("~/.coffee_context.json")
+from .json_utils import json_loads, json_dumps, find_fenced_json, find_first_json_object
+
+HOME_DIR = os.path.expanduser("~")
+CONTEXT_FILE = os.path.join(HOME_DIR, ".coffee_context.json")
+CONFIG_FILE = os.path.join(HOME_DIR, ".coffeerc")
 
 DEFAULT_CONTEXT = {
     "messages": [],
     "chat_history": []
 }
 
-def load_context():
-    """Load context safely with defaults"""
+# Bounded history sizes; the deques evict old entries on append
+HISTORY_LIMITS = {
+    "messages": 5,
+    "chat_history": 10
+}
+
+# In-memory copy of the context file, loaded once per process
+_CTX = None
+# Set while inside grouped_writes(); saves are buffered until the block exits
+_DEFER = False
+_DIRTY = False
+# The context directory only needs creating once per process
+_CTX_DIR_OK = False
+
+def _as_deques(context):
+    for k, maxlen in HISTORY_LIMITS.items():
+        if not isinstance(context.get(k), deque):
+            context[k] = deque(context.get(k, ()), maxlen=maxlen)
+    return context
+
+def _default_context():
+    return _as_deques({})
+
+def _read_context():
     if not os.path.exists(CONTEXT_FILE):
-        return DEFAULT_CONTEXT.copy()
+        return _default_context()
 
     try:
-        with open(CONTEXT_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(CONTEXT_FILE, "rb") as f:
+            data = json_loads(f.read())
     except json.JSONDecodeError:
-        return DEFAULT_CONTEXT.copy()
+        return _default_context()
 
     # ✅ Ensure required keys exist
-    for k, v in DEFAULT_CONTEXT.items():
-        if k not in data:
-            data[k] = v
-    return data
+    return _as_deques(data)
+
+def load_context():
+    """Load context safely with defaults (cached after the first read)"""
+    global _CTX
+    if _CTX is None:
+        _CTX = _read_context()
+    return _CTX
 
 def save_context(context):
-    os.makedirs(os.path.dirname(CONTEXT_FILE), exist_ok=True)
-    with open(CONTEXT_FILE, "w", encoding="utf-8") as f:
-        json.dump(context, f, indent=2)
+    global _CTX, _DIRTY, _CTX_DIR_OK
+    _CTX = _as_deques(context)
+    if _DEFER:
+        _DIRTY = True
+        return
+    _DIRTY = False
+    if not _CTX_DIR_OK:
+        os.makedirs(os.path.dirname(CONTEXT_FILE), exist_ok=True)
+        _CTX_DIR_OK = True
+    # Write to a temp file and rename so a crash never leaves a truncated file
+    tmp = CONTEXT_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(json_dumps({k: list(v) if isinstance(v, deque) else v for k, v in context.items()}))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, CONTEXT_FILE)
+
+@contextmanager
+def grouped_writes():
+    """Collapse every context save made inside the block into one write"""
+    global _DEFER
+    outer = _DEFER
+    _DEFER = True
+    try:
+        yield
+    finally:
+        _DEFER = outer
+        if not outer and _DIRTY:
+            save_context(_CTX)
 
 def is_json_command(content):
     """Check if content looks like a JSON command to avoid polluting chat history"""
+    # Cheap substring guard: plain chat replies skip the JSON parse and scans
+    s = content.lstrip()
+    if not s.startswith("{") and "```" not in content and '"command"' not in content:
+        return False
     try:
-        data = json.loads(content)
+        data = json_loads(content)
         return isinstance(data, dict) and "command" in data
     except json.JSONDecodeError:
-        json_patterns = [
-            r'```json\s*(\{.*?\})\s*```',
-            r'```\s*(\{.*?\})\s*```',
-            r'(\{[\s\S]*?"command"[\s\S]*?\})'
-        ]
-        return any(re.search(pattern, content, re.DOTALL) for pattern in json_patterns)
-
-def add_message(role, content):
-    """Add message to chat history (skip JSON commands)"""
-    if is_json_command(content):
+        span = find_fenced_json(content)
+        if span:
+            try:
+                json_loads(content[span[0]:span[1]])
+                return True
+            except json.JSONDecodeError:
+                pass
+        span = find_first_json_object(content)
+        while span:
+            if '"command"' in content[span[0]:span[1]]:
+                return True
+            span = find_first_json_object(content, span[1])
+        return False
+
+def add_message(role, content, skip_json_check=False):
+    """Add message to chat history (skip JSON commands)
+
+    Pass skip_json_check=True when the caller already knows content is not a JSON command.
+    Direct shell input from the user (/cmd or cd) is never recorded.
+    """
+    if role == "user" and (content.startswith("/") or content[:3] == "cd "):
+        return
+    if not skip_json_check and is_json_command(content):
         return
     context = load_context()
     context["chat_history"].append({"role": role, "content": content})
-    context["chat_history"] = context["chat_history"][-10:]  # keep last 10
     save_context(context)
 
 def get_messages():
@@ -65,8 +140,7 @@ def add_chat_message(role, content):
 
 def get_chat_history():
     """Get chat history safely"""
-    ctx = load_context()
-    return ctx.get("chat_history", [])
+    return list(load_context()["chat_history"])
 
 def add_system_command(user_query, command_data):
     """Store executed commands separately"""
@@ -77,26 +151,37 @@ def add_system_command(user_query, command_data):
         "explanation": command_data.get("explanation"),
         "timestamp": time.time()
     })
-    context["messages"] = context["messages"][-5:]  # keep last 5
     save_context(context)
 
 def get_recent_commands():
-    return load_context().get("messages", [])
+    return list(load_context()["messages"])
 
 def clear_messages():
-    save_context(DEFAULT_CONTEXT.copy())
+    save_context(_default_context())
 
 def get_message_count():
     ctx = load_context()
-    return len(ctx.get("messages", [])) + len(ctx.get("chat_history", []))
+    return len(ctx["messages"]) + len(ctx["chat_history"])
+
+def _freeze(value):
+    """Recursively turn dicts into read-only mappings and lists into tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
 
+@lru_cache(maxsize=1)
 def get_config():
-    config_file = os.path.expanduser("~/.coffeerc")
-    if os.path.exists(config_file):
-        with open(config_file, "r") as f:
-            return json.load(f)
-    return {
+    """Read ~/.coffeerc once per process; the result is shared, so it is deeply read-only"""
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, "rb") as f:
+            config = json_loads(f.read())
+        if not isinstance(config, dict):
+            raise ValueError(f"{CONFIG_FILE} must contain a JSON object, got {type(config).__name__}")
+        return _freeze(config)
+    return _freeze({
         "search_max_results": 20,
         "exclude_dirs": [".git", "node_modules", "venv", "__pycache__"],
         "use_native_tools": True
-    }
+    })
@@ -0,0 +1,84 @@
+# json_utils.py
+import json
+
+# orjson is an optional speedup (pip install coffee-terminal[fast])
+try:
+    import orjson
+
+    def json_loads(data):
+        return orjson.loads(data)
+
+    def json_dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    def json_loads(data):
+        return json.loads(data)
+
+    def json_dumps(obj):
+        return json.dumps(obj, indent=2).encode("utf-8")
+
+def _fence_payload(text, pos):
+    """Return (start, end) of a {...} payload opening right after a fence at pos, or None"""
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    if text[pos:pos + 1] != "{":
+        return None
+    close = text.find("```", pos)
+    if close < 0:
+        return None
+    end = text.rfind("}", pos, close)
+    if end < 0 or text[end + 1:close].strip():
+        return None
+    return pos, end + 1
+
+def find_fenced_json(text):
+    """Return (start, end) of the {...} payload of a ```json fence, else of a bare ``` fence, or None"""
+    i = text.lower().find("```json")
+    if i >= 0:
+        span = _fence_payload(text, i + 7)
+        if span:
+            return span
+    # Bare fences only count when the object opens right after them, so
+    # ```bash or ```js blocks that merely contain braces are not commands
+    i = text.find("```")
+    while i >= 0:
+        span = _fence_payload(text, i + 3)
+        if span:
+            return span
+        i = text.find("```", i + 3)
+    return None
+
+def find_first_json_object(text, pos=0):
+    """Return (start, end) of the first balanced {...} object at or after pos, or None
+
+    A `{` that never closes is skipped rather than ending the search, so a stray
+    brace in prose doesn't hide an object after it. Still a single pass.
+    """
+    start = text.find("{", pos)
+    if start < 0:
+        return None
+    opens = []
+    best = None
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"' and opens:
+            in_string = True
+        elif ch == "{":
+            opens.append(i)
+        elif ch == "}" and opens:
+            begin = opens.pop()
+            if not opens:
+                return begin, i + 1
+            # Closed inside a brace that may never close; keep the earliest one
+            if best is None or begin < best[0]:
+                best = (begin, i + 1)
+    return best
@@ -1,22 +1,31 @@
 import os
-import json
 import platform
 import subprocess
 import typer
-import re
+import atexit
+import base64
+import queue
+import threading
+import time
+import uuid
+from collections import deque
 from rich.console import Console
-from groq import Groq
 
 # Local imports
-from .context_manager import add_message, get_messages, save_context, add_system_command, get_config
+from .context_manager import add_message, get_chat_history, save_context, add_system_command, get_config, grouped_writes, is_json_command, HOME_DIR
+from .json_utils import json_loads, find_fenced_json, find_first_json_object
 
 # --- Setup ---
 console = Console()
 app = typer.Typer(add_completion=False)
 OS_TYPE = platform.system().lower()
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+IS_WINDOWS = platform.system() == "Windows"
+_CLIENT = None
 CURRENT_WORKING_DIRECTORY = os.getcwd()
 
+# Only the tail of a command's output is kept for results and summaries
+OUTPUT_TAIL_CHARS = 2000
+
 # --- AI System Prompts ---
 SYSTEM_PROMPT = f"""
 You are Coffee, a terminal assistant.
@@ -58,6 +67,8 @@ Rules:
 - MAKE SURE YOU ARE EASY TO UNDERSTAND EVEN TO A NEWBIE WITHOUT ANY TECH KNOWLEDGE
 """
 
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+
 TROUBLESHOOTING_PROMPT = """
 A user tried to run the command: `{command}` to accomplish the following task: "{user_message}".
 
@@ -77,37 +88,70 @@ If you cannot suggest a fix, respond with a plain text message explaining the is
 
 # --- Helpers ---
 
+def _client():
+    """Create the Groq client on first use; importing groq is slow and `version`/`reset` never need it."""
+    global _CLIENT
+    if _CLIENT is None:
+        from groq import Groq
+        _CLIENT = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+    return _CLIENT
+
+
 def _extract_json_from_text(text: str):
     if not text:
         return None
     try:
-        return json.loads(text)
+        return json_loads(text)
     except Exception:
         pass
 
-    m = re.search(r'```json\s*(\{[\s\S]*?\})\s*```', text, re.IGNORECASE)
-    if m:
+    span = find_fenced_json(text)
+    if span:
         try:
-            return json.loads(m.group(1))
+            return json_loads(text[span[0]:span[1]])
         except Exception:
             pass
 
-    m = re.search(r'(\{[\s\S]*\})', text)
-    if m:
+    # Walk balanced {...} candidates left to right until one parses; after a
+    # failure, resume just inside it so a valid nested object is still found
+    span = find_first_json_object(text)
+    while span:
         try:
-            return json.loads(m.group(1))
+            return json_loads(text[span[0]:span[1]])
         except Exception:
-            pass
+            span = find_first_json_object(text, span[0] + 1)
 
     return None
 
 
+def _stream_reply(response, echo: bool = True) -> str:
+    """Collect a streamed completion, echoing tokens to the console as they arrive when echo is set."""
+    buf = []
+    shown = False
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        buf.append(delta)
+        if echo and not shown:
+            # Skip the leading whitespace the model sometimes emits
+            delta = "".join(buf).lstrip()
+            shown = bool(delta)
+        if echo and delta:
+            console.print(delta, end="", style="yellow", markup=False, highlight=False)
+    if shown:
+        console.print()
+    return "".join(buf).strip()
+
+
 # --- Core Functions ---
 
 def get_ai_summary(command: str, stdout: str, stderr: str, return_code: int, user_message: str = None) -> str:
-    """Generate a plain contextual sentence about the command's result."""
+    """Generate a plain contextual sentence about the command's result, streaming it to the console."""
     if not stdout and not stderr:
-        return "The command finished with no visible output."
+        summary = "The command finished with no visible output."
+        console.print(f"\n[yellow]{summary}[/yellow]\n")
+        return summary
 
     status = "succeeded" if return_code == 0 else "failed"
 
@@ -115,68 +159,294 @@ def get_ai_summary(command: str, stdout: str, stderr: str, return_code: int, use
 The user asked: "{user_message or 'No specific request provided'}"
 The system then ran the command: `{command}`, which {status}.
 
-STDOUT (first 2000 chars):
+STDOUT (last 2000 chars):
 ---
-{stdout[:2000]}
+{stdout[-2000:]}
 ---
 
-STDERR (first 2000 chars):
+STDERR (last 2000 chars):
 ---
-{stderr[:2000]}
+{stderr[-2000:]}
 ---
 
 Write one short, natural sentence that directly answers the user's request in context.
 Do not mention AI, do not use words like 'summary' or 'explanation'. Just say what happened plainly.
 """
+    return _stream_summary(summary_prompt)
+
+
+def get_ai_summary_batch(results: list, user_message: str = None) -> str:
+    """Summarize every command run by a plan in a single request, streaming it to the console."""
+    if not results:
+        return None
+
+    sections = []
+    for idx, result in enumerate(results, start=1):
+        status = "succeeded" if result["return_code"] == 0 else "failed"
+        sections.append(f"""
+{idx}. `{result['command']}` {status}.
+STDOUT (last 500 chars):
+---
+{result['stdout'][-500:]}
+---
+STDERR (last 500 chars):
+---
+{result['stderr'][-500:]}
+---""")
+
+    steps_text = "".join(sections)
+    summary_prompt = f"""
+The user asked: "{user_message or 'No specific request provided'}"
+The system then ran these commands in order:
+{steps_text}
+
+Write one or two short, natural sentences that directly answer the user's request in context.
+Do not mention AI, do not use words like 'summary' or 'explanation'. Just say what happened plainly.
+"""
+    return _stream_summary(summary_prompt)
+
 
+def _stream_summary(summary_prompt: str) -> str:
+    console.print()
     try:
-        response = client.chat.completions.create(
+        response = _client().chat.completions.create(
             model="llama-3.1-8b-instant",
             messages=[
                 {"role": "system", "content": "You explain terminal results in plain, concise sentences. Always user-friendly, no meta labels."},
                 {"role": "user", "content": summary_prompt}
             ],
             temperature=0.1,
+            stream=True,
         )
-        return response.choices[0].message.content.strip()
+        summary = _stream_reply(response)
     except Exception as e:
-        return f"(Could not generate result: {e})"
+        summary = f"(Could not generate result: {e})"
+        console.print(f"[yellow]{summary}[/yellow]")
+    console.print()
+    return summary
+
+
+class _OutputTail:
+    """Keeps the last `limit` characters of a stream of output lines."""
+
+    def __init__(self, limit: int = OUTPUT_TAIL_CHARS):
+        self.lines = deque()
+        self.size = 0
+        self.limit = limit
+
+    def append(self, line: str):
+        self.lines.append(line)
+        self.size += len(line)
+        while self.size > self.limit:
+            excess = self.size - self.limit
+            if len(self.lines[0]) <= excess:
+                self.size -= len(self.lines.popleft())
+            else:
+                self.lines[0] = self.lines[0][excess:]
+                self.size -= excess
+
+    def text(self) -> str:
+        return "".join(self.lines)
+
+
+def _echo_output(text: str, is_err: bool):
+    console.print(text, end="", style="red" if is_err else None, markup=False, highlight=False)
+
+
+def _pump_output(stream, tail: _OutputTail, is_err: bool):
+    # Bounded reads so a single huge line (minified output, progress bars) is never held whole
+    chunk = ""
+    for chunk in iter(lambda: stream.readline(OUTPUT_TAIL_CHARS), ""):
+        tail.append(chunk)
+        _echo_output(chunk, is_err)
+    if chunk and not chunk.endswith("\n"):
+        _echo_output("\n", is_err)
+
+
+def _run_streaming(cmd: str, timeout: int) -> subprocess.CompletedProcess:
+    """Run cmd through the shell, echoing output live and keeping only its tail."""
+    proc = subprocess.Popen(
+        cmd, shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        text=True, encoding='utf-8', errors='replace', bufsize=1,
+        cwd=CURRENT_WORKING_DIRECTORY
+    )
+    out, err = _OutputTail(), _OutputTail()
+    readers = [
+        threading.Thread(target=_pump_output, args=(proc.stdout, out, False), daemon=True),
+        threading.Thread(target=_pump_output, args=(proc.stderr, err, True), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    deadline = time.monotonic() + timeout
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        raise
+    # A background child can keep the pipes open after the shell exits;
+    # give up on the (daemon) readers once the same deadline passes.
+    for reader in readers:
+        reader.join(max(0, deadline - time.monotonic()))
+        if reader.is_alive():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+    return subprocess.CompletedProcess(cmd, proc.returncode, out.text(), err.text())
+
+
+class _PSHost:
+    """A long-lived PowerShell process shared by every command.
+
+    Spawning powershell.exe costs hundreds of milliseconds of CLR startup, so
+    commands are piped into one process and delimited by per-call markers.
+
+    The host's stdin is the command pipe, not the terminal, so it runs with
+    -NonInteractive: Read-Host, -Confirm and other prompts fail straight away
+    with an error instead of swallowing the next command or hanging until the
+    timeout.
+    """
+
+    def __init__(self):
+        self.proc = None
+        self.out = None
+        self.err = None
+
+    def _start(self):
+        self.proc = subprocess.Popen(
+            ["powershell", "-NoLogo", "-NonInteractive", "-Command", "-"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, encoding='utf-8', errors='replace', bufsize=1,
+            cwd=CURRENT_WORKING_DIRECTORY
+        )
+        self.out = queue.Queue()
+        self.err = queue.Queue()
+        for stream, q in ((self.proc.stdout, self.out), (self.proc.stderr, self.err)):
+            threading.Thread(target=self._pump, args=(stream, q), daemon=True).start()
+        self.proc.stdin.write("[Console]::OutputEncoding = [Text.Encoding]::UTF8\n")
+
+    @staticmethod
+    def _pump(stream, q):
+        for line in stream:
+            q.put(line)
+        q.put(None)
+
+    def close(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
+        self.proc = None
+
+    def run(self, cmd: str, cwd: str, timeout: int) -> subprocess.CompletedProcess:
+        if self.proc is None or self.proc.poll() is not None:
+            self._start()
+
+        marker = uuid.uuid4().hex
+        payload = base64.b64encode(cmd.encode("utf-8")).decode("ascii")
+        # stdin is decoded with the console code page, so non-ASCII paths go in base64 too
+        location = base64.b64encode(cwd.encode("utf-8")).decode("ascii")
+        # One line so a terminating error can't skip the markers. Piping into
+        # Out-Default flushes formatted output (tables from Select-Object,
+        # ConvertFrom-Json, ...) before the markers are written, which bypass
+        # the pipeline. The exit code mirrors `powershell -Command`: native
+        # exit code, else 0/1 depending on whether the command wrote errors.
+        script = (
+            "$global:LASTEXITCODE = 0; $coffeeOk = $false; "
+            "try { Set-Location -ErrorAction Stop -LiteralPath "
+            f"([Text.Encoding]::UTF8.GetString([Convert]::FromBase64String('{location}'))); "
+            "Invoke-Expression -ErrorVariable coffeeErr -Command "
+            f"([Text.Encoding]::UTF8.GetString([Convert]::FromBase64String('{payload}'))) | Out-Default; "
+            "$coffeeOk = $coffeeErr.Count -eq 0 } catch { [Console]::Error.WriteLine($_) }; "
+            "$coffeeRc = if ($LASTEXITCODE) { $LASTEXITCODE } elseif ($coffeeOk) { 0 } else { 1 }; "
+            f"[Console]::Out.WriteLine(\"<<<COFFEE_RC:{marker}:$coffeeRc>>>\"); "
+            f"[Console]::Error.WriteLine('<<<COFFEE_EOF:{marker}>>>')\n"
+        )
+        rc_prefix = f"<<<COFFEE_RC:{marker}:"
+        try:
+            self.proc.stdin.write(script)
+            self.proc.stdin.flush()
+
+            deadline = time.monotonic() + timeout
+            stdout, rc_line = self._read_until(self.out, rc_prefix, False, cmd, timeout, deadline)
+            stderr, _ = self._read_until(self.err, f"<<<COFFEE_EOF:{marker}>>>", True, cmd, timeout, deadline)
+            if rc_line is None:
+                # The command called `exit N` and took the host down with it;
+                # report N, as the one-shot `powershell -Command` did
+                return_code = self.proc.wait(timeout=max(0, deadline - time.monotonic()))
+                self.proc = None
+            else:
+                return_code = int(rc_line[len(rc_prefix):].rstrip().rstrip(">"))
+        except BaseException:
+            # Don't leave queued output behind for the next command to read as its own
+            self.close()
+            raise
+        return subprocess.CompletedProcess(cmd, return_code, stdout, stderr)
+
+    def _read_until(self, q, marker, is_err, cmd, timeout, deadline):
+        """Collect lines from q up to the marker; the marker line is returned, or None if the host exited."""
+        tail = _OutputTail()
+        while True:
+            try:
+                line = q.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            if line is None:
+                return tail.text(), None
+            # Output without a trailing newline leaves the marker mid-line
+            idx = line.find(marker)
+            if idx >= 0:
+                if idx:
+                    tail.append(line[:idx])
+                    _echo_output(line[:idx] + "\n", is_err)
+                return tail.text(), line[idx:]
+            tail.append(line)
+            _echo_output(line, is_err)
+
+
+_PS_HOST = _PSHost()
+atexit.register(_PS_HOST.close)
+
+
+def _run_powershell(cmd: str, timeout: int) -> subprocess.CompletedProcess:
+    """Run cmd on the shared PowerShell host, or one-shot if the host can't be used."""
+    try:
+        return _PS_HOST.run(cmd, CURRENT_WORKING_DIRECTORY, timeout)
+    except OSError:
+        # The host failed to spawn or its stdin is gone, so cmd never ran
+        _PS_HOST.close()
+        proc = subprocess.run(
+            ["powershell", "-Command", cmd],
+            capture_output=True, text=True, timeout=timeout,
+            encoding='utf-8', errors='replace',
+            cwd=CURRENT_WORKING_DIRECTORY
+        )
+        for stream, is_err in ((proc.stdout, False), (proc.stderr, True)):
+            if stream:
+                _echo_output(stream if stream.endswith("\n") else stream + "\n", is_err)
+        return proc
+
+
+def run_shell_command(cmd: str, timeout: int = 60, user_message: str = None, summarize: bool = True) -> dict:
+    """Execute a shell command and return a structured result.
 
+    Output is echoed as it is produced; stdout/stderr in the result hold only
+    the last OUTPUT_TAIL_CHARS characters of each stream.
 
-def run_shell_command(cmd: str, timeout: int = 60, user_message: str = None) -> dict:
-    """Execute a shell command and return a structured result."""
+    With summarize=False the per-command AI summary is skipped (summary is None),
+    leaving the caller to summarize several results at once.
+    """
     console.print(f"[cyan]Running:[/cyan] {cmd}")
     try:
-        if "windows" in OS_TYPE:
+        if IS_WINDOWS:
             if cmd.startswith("touch "):
                 filename = cmd.split(" ", 1)[1]
                 cmd = f"New-Item {filename} -ItemType File"
-        if "windows" in OS_TYPE:
-            proc = subprocess.run(
-                ["powershell", "-Command", cmd],
-                capture_output=True, text=True, timeout=timeout,
-                encoding='utf-8', errors='replace',
-                cwd=CURRENT_WORKING_DIRECTORY
-            )
+            proc = _run_powershell(cmd, timeout)
         else:
-            proc = subprocess.run(
-                cmd, shell=True,
-                capture_output=True, text=True, timeout=timeout,
-                encoding='utf-8', errors='replace',
-                cwd=CURRENT_WORKING_DIRECTORY
-            )
+            proc = _run_streaming(cmd, timeout)
 
         stdout = proc.stdout or ""
         stderr = proc.stderr or ""
         return_code = proc.returncode
 
-        if stdout:
-            console.print(f"\n[green]Output:[/green]\n{stdout.strip()}")
-        if stderr:
-            console.print(f"\n[red]Error:[/red]\n{stderr.strip()}")
-
-        summary = get_ai_summary(cmd, stdout, stderr, return_code, user_message)
-        console.print(f"\n[yellow]{summary}[/yellow]\n")
+        summary = get_ai_summary(cmd, stdout, stderr, return_code, user_message) if summarize else None
 
         return {
             "command": cmd,
@@ -222,6 +492,7 @@ def execute_plan(plan: dict, user_message: str):
         return
 
     console.print(f"[cyan]Executing {len(steps)} steps...[/cyan]\n")
+    results = []
 
     for idx, step in enumerate(steps, start=1):
         explanation = step.get("explanation", f"Step {idx}")
@@ -234,7 +505,7 @@ def execute_plan(plan: dict, user_message: str):
                 try:
                     target_dir = cmd.split(" ", 1)[1]
                     if target_dir == "~":
-                        target_dir = os.path.expanduser("~")
+                        target_dir = HOME_DIR
                     
                     if not os.path.isabs(target_dir):
                         target_dir = os.path.join(CURRENT_WORKING_DIRECTORY, target_dir)
@@ -248,7 +519,8 @@ def execute_plan(plan: dict, user_message: str):
                     console.print(f"[red]Error changing directory: {e}[/red]")
                 continue
 
-            result = run_shell_command(cmd, user_message=user_message)
+            result = run_shell_command(cmd, user_message=user_message, summarize=False)
+            results.append(result)
 
             if result["return_code"] != 0:
                 console.print(f"[red]Step {idx} failed, stopping execution.[/red]")
@@ -284,6 +556,7 @@ def execute_plan(plan: dict, user_message: str):
                 console.print(f"[red]❌ Failed to read file {path}: {e}[/red]\n")
                 break
 
+    get_ai_summary_batch(results, user_message)
     console.print("\n[bold green]✅ Flow completed.[/bold green]\n")
 
 
@@ -312,7 +585,10 @@ def process_ai_response(ai_out: str, user_query: str):
     
     if not action:
         console.print(f"[yellow]{ai_out}[/yellow]")
-        add_message("assistant", ai_out)
+        # Not parseable doesn't mean not a command (e.g. a trailing comma), so
+        # decide once here and hand the verdict to add_message
+        if not is_json_command(ai_out):
+            add_message("assistant", ai_out, skip_json_check=True)
         return
 
     if "plan" in action:
@@ -339,7 +615,7 @@ def process_ai_response(ai_out: str, user_query: str):
         
         if typer.confirm("\nExecute this plan?", default=True):
             execute_plan(action, user_query)
-            add_message("assistant", f"Executed plan with {len(plan_steps)} steps for: {user_query}")
+            add_message("assistant", f"Executed plan with {len(plan_steps)} steps for: {user_query}", skip_json_check=True)
         else:
             console.print("[yellow]Plan execution cancelled.[/yellow]")
         return
@@ -356,7 +632,7 @@ def process_ai_response(ai_out: str, user_query: str):
             try:
                 target_dir = cmd.split(" ", 1)[1]
                 if target_dir == "~":
-                    target_dir = os.path.expanduser("~")
+                    target_dir = HOME_DIR
                 
                 if not os.path.isabs(target_dir):
                     target_dir = os.path.join(CURRENT_WORKING_DIRECTORY, target_dir)
@@ -388,7 +664,8 @@ def process_ai_response(ai_out: str, user_query: str):
 
     console.print(f"[red]Unrecognized response format: {action}[/red]")
     console.print(f"[yellow]{ai_out}[/yellow]")
-    add_message("assistant", ai_out)
+    if not is_json_command(ai_out):
+        add_message("assistant", ai_out, skip_json_check=True)
 
 
 def call_groq(prompt: str):
@@ -396,17 +673,19 @@ def call_groq(prompt: str):
         console.print("[red]GROQ_API_KEY not set.[/red]")
         return None
 
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-    messages.extend(get_messages())
-    messages.append({"role": "user", "content": prompt})
+    messages = [_SYSTEM_MSG, *get_chat_history(), {"role": "user", "content": prompt}]
     try:
-        response = client.chat.completions.create(
+        response = _client().chat.completions.create(
             model="llama-3.1-8b-instant", 
             messages=messages, 
             temperature=0.2,
-            max_tokens=4000
+            max_tokens=4000,
+            stream=True,
         )
-        ai_reply = response.choices[0].message.content.strip()
+        # Replies can carry a command anywhere ("Sure! ```json {...}```"), so
+        # they are collected silently and shown once process_ai_response has parsed them
+        with console.status("[dim]Thinking...[/dim]"):
+            ai_reply = _stream_reply(response, echo=False)
         add_message("user", prompt)
         return ai_reply
     except Exception as e:
@@ -424,7 +703,7 @@ def coffee_shell():
 
     while True:
         try:
-            prompt_path = CURRENT_WORKING_DIRECTORY.replace(os.path.expanduser("~"), "~")
+            prompt_path = CURRENT_WORKING_DIRECTORY.replace(HOME_DIR, "~")
             query = console.input(f"[bold green]coffee ({prompt_path})> [/bold green]").strip()
             if not query:
                 continue
@@ -433,7 +712,7 @@ def coffee_shell():
             
             # NEW: Direct handling for clear/cls
             if query.lower() in ["clear", "cls"]:
-                if "windows" in OS_TYPE:
+                if IS_WINDOWS:
                     os.system("cls")
                 else:
                     os.system("clear")
@@ -449,7 +728,7 @@ def coffee_shell():
                 try:
                     target_dir = query.split(" ", 1)[1]
                     if target_dir == "~":
-                        target_dir = os.path.expanduser("~")
+                        target_dir = HOME_DIR
                     
                     if not os.path.isabs(target_dir):
                         target_dir = os.path.join(CURRENT_WORKING_DIRECTORY, target_dir)
@@ -462,9 +741,10 @@ def coffee_shell():
                     console.print(f"[red]Error changing directory: {e}[/red]")
                 continue
 
-            ai_response = call_groq(query)
-            if ai_response:
-                process_ai_response(ai_response, query)
+            with grouped_writes():
+                ai_response = call_groq(query)
+                if ai_response:
+                    process_ai_response(ai_response, query)
 
         except (KeyboardInterrupt, EOFError):
             break
@@ -14,6 +14,9 @@ setup(
         "rich>=13.0.0",
         "groq>=0.4.0",
     ],
+    extras_require={
+        "fast": ["orjson>=3.0"],
+    },
     entry_points={
         "console_scripts": [
             "coffee=coffee.main:app",